@@ -1,7 +1,18 @@
+import mmap
+import struct
+import sys
+from collections import namedtuple
 from typing import List, Text, Optional
-from ctypes import sizeof, LittleEndianStructure, BigEndianStructure, c_uint8, c_uint16, c_uint32, c_uint64, c_uint
+from ctypes import sizeof, LittleEndianStructure, BigEndianStructure, c_uint8, c_uint16, c_uint64, c_uint
 from crcmod.predefined import mkPredefinedCrcFun
 from enum import Enum
+import numpy as np
+
+try:
+    from ._parser import parse_metadata_header_c, parse_seektable_c, parse_vorbis_comment_c
+except ImportError:
+    # the Cython extension isn't built, FlacParser uses its pure-Python parsers instead
+    parse_metadata_header_c = parse_seektable_c = parse_vorbis_comment_c = None
 
 
 class MetadataBlockType(Enum):
@@ -16,13 +27,21 @@ class MetadataBlockType(Enum):
     INVALID = 127
 
 
-class MetadataBlockHeader(BigEndianStructure):
-    _pack_ = 1
-    _fields_ = [
-        ('is_last_block', c_uint32, 1),
-        ('block_type', c_uint32, 7),
-        ('length', c_uint32, 24),
-    ]
+# raw block type value -> name, so logging doesn't go through MetadataBlockType() per block
+_BTYPE_NAMES = {m.value: m.name for m in MetadataBlockType}
+
+
+class MetadataBlockHeader(namedtuple('MetadataBlockHeader', 'is_last_block block_type length')):
+    # 1 bit is_last_block, 7 bits block_type, 24 bits length
+    FORMAT = struct.Struct('>I')
+
+    __slots__ = ()
+
+    @classmethod
+    def unpack_from(cls, buffer, offset=0):
+        # type: (bytes, int) -> MetadataBlockHeader
+        val, = cls.FORMAT.unpack_from(buffer, offset)
+        return cls(val >> 31, (val >> 24) & 0x7F, val & 0xFFFFFF)
 
 
 class MetadataBlockData(BigEndianStructure):
@@ -35,38 +54,53 @@ class MetadataBlockDataLittleEndian(LittleEndianStructure):
 
 
 class MetadataBlockStreamInfo(MetadataBlockData):
+    # ctypes starts a new storage unit whenever a bitfield doesn't fit the current one,
+    # so the bitfields are grouped into whole 64 bit words to match the 34 byte on-disk layout
     _fields_ = [
-        ('min_block_size', c_uint16, 16),
-        ('max_block_size', c_uint16, 16),
-        ('min_frame_size', c_uint32, 24),
-        ('max_frame_size', c_uint32, 24),
-        ('sample_rate_hz', c_uint32, 20),
-        ('num_channels', c_uint8, 3),
-        ('bits_per_sample', c_uint8, 5),
+        ('min_block_size', c_uint16),
+        ('max_block_size', c_uint64, 16),
+        ('min_frame_size', c_uint64, 24),
+        ('max_frame_size', c_uint64, 24),
+        ('sample_rate_hz', c_uint64, 20),
+        # stored as (number of channels)-1 and (bits per sample)-1
+        ('num_channels', c_uint64, 3),
+        ('bits_per_sample', c_uint64, 5),
         ('total_sample_count', c_uint64, 36),
-        ('md5_low', c_uint64, 64),
-        ('md5_high', c_uint64, 64),
+        ('md5', c_uint8 * 16),
     ]
 
 
 class MetadataBlock(object):
+    __slots__ = ('header', 'data')
+
     def __init__(self, header, data):
         # type: (MetadataBlockHeader, MetadataBlockData) -> None
         self.header = header
         self.data = data
 
 
-class MetadataSeekPoint(MetadataBlockData):
-    _fields_ = [
-        ('first_sample_number', c_uint64, 64),
-        ('target_offset', c_uint64, 64),
-        ('target_num_samples', c_uint16, 16),
-    ]
+# a single seek point, seek tables are returned as arrays of this (native byte order)
+SEEKPOINT_DTYPE = np.dtype([
+    ('first_sample_number', '=u8'),
+    ('target_offset', '=u8'),
+    ('target_num_samples', '=u2'),
+])
+# the big endian layout seek points have on disk
+_SEEKPOINT_DISK_DTYPE = SEEKPOINT_DTYPE.newbyteorder('>')
+
+# computed once rather than per read
+_STREAMINFO_SIZE = sizeof(MetadataBlockStreamInfo)
+
+# each SeekPoint is 18 bytes as defined by the standard
+assert SEEKPOINT_DTYPE.itemsize == 18, 'bad seekpoint def? not 18 bytes'
+# and the STREAMINFO body is 34 bytes
+assert _STREAMINFO_SIZE == 34, 'bad stream info def? not 34 bytes'
 
 
 class MetadataBlockSeekTable(MetadataBlockData):
     def __init__(self, seek_points):
-        # type: (List[MetadataSeekPoint]) -> None
+        # type: (np.ndarray) -> None
+        # structured array of SEEKPOINT_DTYPE
         self.seek_points = seek_points
 
 
@@ -77,27 +111,56 @@ class MetadataBlockVorbisComment(MetadataBlockDataLittleEndian):
         self.user_comments = user_comments
 
 
-class MetadataBlockPadding(MetadataBlockData):
+# not a ctypes struct like the other block data, padding is never read and only its length is kept
+class MetadataBlockPadding(object):
+    __slots__ = ('length',)
+
     def __init__(self, length):
         self.length = length
 
 
-class FrameHeaderRaw(BigEndianStructure):
+class FrameHeaderRaw(namedtuple('FrameHeaderRaw', [
+    'sync_code',
+    'reserved1',
+    'blocking_strategy',
+    'block_size',
+    'sample_rate',
+    'channel',
+    'sample_size',
+    'reserved2',
+    'frame_number',
+    'crc',
+    'packed',
+    'raw_bytes',
+])):
     SYNC_CODE = '0b11111111111110'
-
-    _pack_ = 1
-    _fields_ = [
-        ('sync_code', c_uint16, 14),
-        ('reserved1', c_uint8, 1),
-        ('blocking_strategy', c_uint8, 1),
-        ('block_size', c_uint8, 4),
-        ('sample_rate', c_uint8, 4),
-        ('channel', c_uint8, 4),
-        ('sample_size', c_uint8, 3),
-        ('reserved2', c_uint8, 1),
-        ('frame_number', c_uint8, 8),
-        ('crc', c_uint8, 8),
-    ]
+    # 32 bits of packed fields (14/1/1/4/4/4/3/1), then frame number and CRC-8 bytes
+    FORMAT = struct.Struct('>IBB')
+
+    __slots__ = ()
+
+    @classmethod
+    def unpack(cls, raw_bytes):
+        # type: (bytes) -> FrameHeaderRaw
+        val, frame_number, crc = cls.FORMAT.unpack(raw_bytes)
+        return cls(
+            sync_code=val >> 18,
+            reserved1=(val >> 17) & 0x1,
+            blocking_strategy=(val >> 16) & 0x1,
+            block_size=(val >> 12) & 0xF,
+            sample_rate=(val >> 8) & 0xF,
+            channel=(val >> 4) & 0xF,
+            sample_size=(val >> 1) & 0x7,
+            reserved2=val & 0x1,
+            frame_number=frame_number,
+            crc=crc,
+            packed=val,
+            raw_bytes=raw_bytes,
+        )
+
+
+# reserved1 and reserved2 bit positions within FrameHeaderRaw.packed
+_FH_RESERVED_MASK = (1 << (32 - 15)) | (1 << 0)
 
 
 class BlockingStrategy(Enum):
@@ -159,7 +222,7 @@ class SubframeHeader(object):
             raise RuntimeError('Unknown subframe type {}'.format(hex(type)))
 
     def read_subframe_type(self):
-        type = c_uint8.from_buffer(bytearray(self.flac_file.read(1))).value
+        type = c_uint8.from_buffer_copy(self.flac_file.read(1)).value
         # interpret 'wasted bits per sample' flag
         flag = type & 0x10000000
         if flag != 0:
@@ -175,6 +238,17 @@ class SubframeHeader(object):
 
 
 class FrameHeader(object):
+    __slots__ = (
+        'raw_header',
+        'blocking_strategy',
+        'block_size',
+        'sample_rate',
+        'channels',
+        'sample_bit_count',
+        'frame_number',
+        'crc',
+    )
+
     def __init__(self, raw_header):
         # type: (FrameHeaderRaw) -> None
         self.raw_header = raw_header
@@ -199,7 +273,7 @@ class FrameHeader(object):
             raise NotImplementedError()
 
     def verify_crc(self):
-        frame_header_bytes = bytearray(self.raw_header)
+        frame_header_bytes = self.raw_header.raw_bytes
         # we want to check everything up to (but not including) the CRC, which is the last byte
         bytes_to_verify = frame_header_bytes[:-1]
         correct_crc = frame_header_bytes[-1]
@@ -297,10 +371,9 @@ class FrameHeader(object):
         return sample_size_map[sample_size]
 
     def validate_header(self):
-        if self.raw_header.reserved1 != 0:
-            raise RuntimeError('frame_header->reserved1 was not 0!')
-        if self.raw_header.reserved2 != 0:
-            raise RuntimeError('frame_header->reserved2 was not 0!')
+        # both reserved bits must be 0, check them together against the packed header word
+        if self.raw_header.packed & _FH_RESERVED_MASK:
+            raise RuntimeError('frame_header reserved bits were not 0! ({:08x})'.format(self.raw_header.packed))
 
     def dump(self):
         # type: () -> None
@@ -334,7 +407,7 @@ class FlacSubframe(object):
     def read_audio_sample(self):
         bits_per_sample = self.frame_header.sample_bit_count
         bytes_per_sample = round((bits_per_sample / 8) + 0.5)
-        constant_val = c_uint16.from_buffer(bytearray(self.flac_file.read(bytes_per_sample))).value
+        constant_val = c_uint16.from_buffer_copy(self.flac_file.read(bytes_per_sample)).value
         # trim to the actual sample bits
         # add 2 to account for '0b' prefix
         constant_val = str(bin(constant_val))[:bits_per_sample+2]
@@ -347,7 +420,7 @@ def read_big_endian_uint16(flac_file):
     # type: (file) -> int
     int_bytes =  flac_file.read(2)
     int_bytes = bytes([c for t in zip(int_bytes[1::2], int_bytes[::2]) for c in t])
-    return c_uint16.from_buffer(bytearray(int_bytes)).value
+    return c_uint16.from_buffer_copy(int_bytes).value
 
 
 class FlacFrame(object):
@@ -369,11 +442,12 @@ class FlacFrame(object):
             raise NotImplementedError()
         for channel in range(self.header.channels.channel_count()):
             subframes.append(self.parse_subframe())
-        print('Audio samples: ')
-        print('\t({} {})'.format(
-            [hex(x) for x in subframes[0].audio_data],
-            [hex(x) for x in subframes[1].audio_data]
-        ))
+        if self.parser.verbose:
+            print('Audio samples: ')
+            print('\t({} {})'.format(
+                [hex(x) for x in subframes[0].audio_data],
+                [hex(x) for x in subframes[1].audio_data]
+            ))
         return subframes
 
     def parse_subframe(self):
@@ -382,9 +456,9 @@ class FlacFrame(object):
 
     def parse_frame_header(self):
         # type: () -> FrameHeader
-        print('{}: frame header'.format(hex(self.file.tell())))
-        raw_header_bytes = bytearray(bytes(self.file.read(sizeof(FrameHeaderRaw))))
-        raw_header = FrameHeaderRaw.from_buffer(raw_header_bytes)
+        if self.parser.verbose:
+            print('{}: frame header'.format(hex(self.file.tell())))
+        raw_header = FrameHeaderRaw.unpack(self.file.read(FrameHeaderRaw.FORMAT.size))
         if bin(raw_header.sync_code) != FrameHeaderRaw.SYNC_CODE:
             raise RuntimeError('FrameHeader sync code was incorrect (got {})'.format(bin(raw_header.sync_code)))
         header = FrameHeader(raw_header)
@@ -409,117 +483,214 @@ class FlacFrame(object):
 
 
 class FlacParser(object):
-    def __init__(self, flac_file):
-        # type: (file) -> None
+    def __init__(self, flac_file, verbose=False):
+        # type: (file, bool) -> None
         self.flac = flac_file
-        self.parse_magic()
+        self.verbose = verbose
+        # metadata is parsed out of an mmap of the file when possible, and read from it piecemeal otherwise;
+        # self._pos is the absolute file offset of the next unparsed byte
+        self._pos = self.flac.tell()
+
+        # block type value -> parser for that block's data, PADDING is skipped before dispatch
+        self._dispatch = {
+            MetadataBlockType.STREAMINFO.value: self.parse_streaminfo,
+            MetadataBlockType.SEEKTABLE.value: self.parse_seektable,
+            MetadataBlockType.VORBIS_COMMENT.value: self.parse_vorbis_comment,
+        }
 
         # FLAC guarantees at least one metadata block; the stream info block
         self.metadata_blocks = []
-        while True:
-            try:
-                metadata_block = self.parse_metadata_block()
-                self.metadata_blocks.append(metadata_block)
-            except NotImplementedError:
-                print('Parsed up to unknown metadata block type, stopping here')
-                break
-
-            if metadata_block.header.is_last_block:
-                break
-        print('Finished parsing {} metadata blocks'.format(len(self.metadata_blocks)))
+        # first block seen of each type, keyed by raw block type value
+        self._blocks_by_type = {}
+        # the mapping is only needed for the metadata, don't keep the file mapped past that
+        # (None when the file can't be mapped)
+        self._mm = self.map_file()
+        try:
+            self.parse_metadata_blocks()
+        finally:
+            self.unmap_file()
+        if self.verbose:
+            print('Finished parsing {} metadata blocks'.format(len(self.metadata_blocks)))
+        # audio frames are still read through the file object, so hand it our position
+        self.flac.seek(self._pos)
 
         self.stream_info = self.get_metadata_block_with_type(MetadataBlockType.STREAMINFO)
         self.seek_table = self.get_metadata_block_with_type(MetadataBlockType.SEEKTABLE)
         self.vorbis_comments = self.get_metadata_block_with_type(MetadataBlockType.VORBIS_COMMENT)
 
-        # self.dump_stream_info()
-        # self.dump_seek_table()
-        # self.dump_vorbis_comments()
+        if self.verbose:
+            self.dump_stream_info()
+            if self.seek_table:
+                self.dump_seek_table()
+            if self.vorbis_comments:
+                self.dump_vorbis_comments()
 
         frame = FlacFrame(self)
         frame = FlacFrame(self)
         frame = FlacFrame(self)
         frame = FlacFrame(self)
 
+    def map_file(self):
+        # type: () -> Optional[mmap.mmap]
+        try:
+            mm = mmap.mmap(self.flac.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            # not backed by a real (non-empty) file, e.g. BytesIO; read_bytes() reads from it directly
+            return None
+        # metadata is parsed strictly front to back, and nearly always fits in the first MiB
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            mm.madvise(mmap.MADV_WILLNEED, 0, min(1 << 20, len(mm)))
+        return mm
+
+    def unmap_file(self):
+        # type: () -> None
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = None
+
+    def parse_metadata_blocks(self):
+        # type: () -> None
+        metadata_block = self.parse_stream_info_block()
+        while True:
+            self.metadata_blocks.append(metadata_block)
+            self._blocks_by_type.setdefault(metadata_block.header.block_type, metadata_block)
+            if metadata_block.header.is_last_block:
+                break
+
+            try:
+                metadata_block = self.parse_metadata_block()
+            except NotImplementedError:
+                if self.verbose:
+                    print('Parsed up to unknown metadata block type, stopping here')
+                break
+
     def get_metadata_block_with_type(self, block_type):
         # type: (MetadataBlockType) -> Optional[MetadataBlock]
-        for x in self.metadata_blocks:
-            if x.header.block_type == block_type.value:
-                return x
-        return None
+        return self._blocks_by_type.get(block_type.value)
 
     def dump_stream_info(self):
-        print('FLAC ({}) audio stream info:'.format(self.flac.name))
-
-        print('\tSmallest block size: {}'.format(self.stream_info.data.min_block_size))
-        print('\tLargest block size: {}'.format(self.stream_info.data.max_block_size))
-        print('\tSmallest frame size: {}'.format(self.stream_info.data.min_frame_size))
-        print('\tLargest frame size: {}'.format(self.stream_info.data.max_frame_size))
-        print('\tSample rate (in Hz): {}'.format(self.stream_info.data.sample_rate_hz))
-        print('\tChannel count: {}'.format(self.stream_info.data.num_channels))
-        print('\tBits per sample: {}'.format(self.stream_info.data.bits_per_sample))
-        print('\tTotal sample count: {}'.format(self.stream_info.data.total_sample_count))
-
-        md5_sig = str(self.stream_info.data.md5_low) + str(self.stream_info.data.md5_high)
-        print('\tMD5 signature of audio stream: {}'.format(md5_sig))
+        stream_info = self.stream_info.data
+        md5_sig = bytes(stream_info.md5).hex()
+        lines = [
+            'FLAC ({}) audio stream info:'.format(getattr(self.flac, 'name', '<stream>')),
+            '\tSmallest block size: {}'.format(stream_info.min_block_size),
+            '\tLargest block size: {}'.format(stream_info.max_block_size),
+            '\tSmallest frame size: {}'.format(stream_info.min_frame_size),
+            '\tLargest frame size: {}'.format(stream_info.max_frame_size),
+            '\tSample rate (in Hz): {}'.format(stream_info.sample_rate_hz),
+            '\tChannel count: {}'.format(stream_info.num_channels + 1),
+            '\tBits per sample: {}'.format(stream_info.bits_per_sample + 1),
+            '\tTotal sample count: {}'.format(stream_info.total_sample_count),
+            '\tMD5 signature of audio stream: {}'.format(md5_sig),
+        ]
+        sys.stdout.write('\n'.join(lines) + '\n')
 
     def dump_seek_table(self):
-        print('Seek table ({} entries):'.format(len(self.seek_table.data.seek_points)))
-        for i, seek_point in enumerate(self.seek_table.data.seek_points):
-            print('\tseek point {}:'.format(i))
-            print('\t\tFirst sample number: {}'.format(seek_point.first_sample_number))
-            print('\t\tTarget sample offset: {}'.format(seek_point.target_offset))
-            print('\t\tTarget sample count: {}'.format(seek_point.target_num_samples))
+        seek_points = self.seek_table.data.seek_points
+        lines = ['Seek table ({} entries):'.format(len(seek_points))]
+        lines.extend(
+            '\tseek point {}:\n'
+            '\t\tFirst sample number: {}\n'
+            '\t\tTarget sample offset: {}\n'
+            '\t\tTarget sample count: {}'.format(i, first_sample_number, target_offset, target_num_samples)
+            for i, (first_sample_number, target_offset, target_num_samples) in enumerate(seek_points.tolist())
+        )
+        sys.stdout.write('\n'.join(lines) + '\n')
 
     def dump_vorbis_comments(self):
         comments = self.vorbis_comments.data
-        print('{} Vorbis comments. Vendor: {}'.format(len(comments.user_comments), comments.vendor_string))
-        for comment in comments.user_comments:
-            print('\t{}'.format(comment))
-
-    def parse_magic(self):
-        correct_magic = b'fLaC'
-        magic = self.flac.read(4)
-        for i, b in enumerate(magic):
-            if b is not correct_magic[i]:
-                print('incorrect magic byte {}, expected {}'.format(b, correct_magic[i]))
-        print('FLAC magic verified')
+        lines = ['{} Vorbis comments. Vendor: {}'.format(len(comments.user_comments), comments.vendor_string)]
+        lines.extend('\t{}'.format(comment) for comment in comments.user_comments)
+        sys.stdout.write('\n'.join(lines) + '\n')
 
-    def parse_metadata_header(self):
-        header_bytes = bytearray(bytes(self.flac.read(sizeof(MetadataBlockHeader))))
-        header = MetadataBlockHeader.from_buffer(header_bytes)
-        return header
+    def parse_magic(self, magic):
+        # type: (bytes) -> None
+        if magic != b'fLaC':
+            raise RuntimeError('bad FLAC magic {!r}'.format(magic))
+        if self.verbose:
+            print('FLAC magic verified')
 
-    def read_ctype_from_file(self, ctype_type):
-        raw_bytes = bytearray(bytes(self.flac.read(sizeof(ctype_type))))
-        return ctype_type.from_buffer(raw_bytes)
+    def parse_metadata_header(self):
+        raw_header = self.read_bytes(MetadataBlockHeader.FORMAT.size)
+        # checked here rather than left to either decoder, so both fail the same way
+        if len(raw_header) < MetadataBlockHeader.FORMAT.size:
+            raise RuntimeError('metadata block header runs past end of file')
+        if parse_metadata_header_c is not None:
+            return MetadataBlockHeader(*parse_metadata_header_c(raw_header, 0))
+        return MetadataBlockHeader.unpack_from(raw_header)
+
+    def read_bytes(self, length):
+        # type: (int) -> bytes
+        # all metadata reads go through here; may return fewer bytes at the end of the file
+        if self._mm is not None:
+            raw_bytes = self._mm[self._pos:self._pos + length]
+        else:
+            self.flac.seek(self._pos)
+            raw_bytes = self.flac.read(length)
+        self._pos += length
+        return raw_bytes
+
+    def parse_streaminfo(self, header):
+        # type: (MetadataBlockHeader) -> MetadataBlockStreamInfo
+        if header.block_type != MetadataBlockType.STREAMINFO.value:
+            raise RuntimeError('wrong header passed to parse_streaminfo()')
+        raw_stream_info = self.read_bytes(_STREAMINFO_SIZE)
+        if len(raw_stream_info) < _STREAMINFO_SIZE:
+            raise RuntimeError('STREAMINFO block runs past end of file')
+        return MetadataBlockStreamInfo.from_buffer_copy(raw_stream_info)
 
     def parse_seektable(self, header):
         # type: (MetadataBlockHeader) -> MetadataBlockSeekTable
         if header.block_type != MetadataBlockType.SEEKTABLE.value:
             raise RuntimeError('wrong header passed to parse_seektable()')
-        # each SeekPoint is 18 bytes as defined by the standard
-        if sizeof(MetadataSeekPoint) != 18:
-            raise RuntimeError('bad seekpoint def? not 18 bytes, {}'.format(sizeof(MetadataSeekPoint)))
-        seekpoint_count = int(header.length / 18)
-        seekpoints = []
-        for i in range(seekpoint_count):
-            seekpoint = self.read_ctype_from_file(MetadataSeekPoint)
-            seekpoints.append(seekpoint)
+        seekpoint_count = header.length // SEEKPOINT_DTYPE.itemsize
+        raw_seekpoints = self.read_bytes(seekpoint_count * SEEKPOINT_DTYPE.itemsize)
+        if len(raw_seekpoints) < seekpoint_count * SEEKPOINT_DTYPE.itemsize:
+            raise RuntimeError('seek table runs past end of file')
+        if parse_seektable_c is not None:
+            seekpoints = parse_seektable_c(raw_seekpoints, seekpoint_count, SEEKPOINT_DTYPE)
+        else:
+            disk_seekpoints = np.frombuffer(raw_seekpoints, dtype=_SEEKPOINT_DISK_DTYPE, count=seekpoint_count)
+            seekpoints = disk_seekpoints.astype(SEEKPOINT_DTYPE)
         return MetadataBlockSeekTable(seekpoints)
 
     def parse_vorbis_comment(self, header):
         # type: (MetadataBlockHeader) -> MetadataBlockVorbisComment
         if header.block_type != MetadataBlockType.VORBIS_COMMENT.value:
             raise RuntimeError('wrong header passed to parse_vorbis_comment()')
-        vendor_length = self.read_ctype_from_file(c_uint32).value
-        vendor_string = self.flac.read(vendor_length).decode('utf-8')
-        user_comment_list_len = self.read_ctype_from_file(c_uint32).value
-        user_comments = []
+        # the block is small and its length is known, so pull it in at once and walk it locally
+        # vorbis comment lengths are little endian, unlike the rest of FLAC
+        block = self.read_bytes(header.length)
+        if parse_vorbis_comment_c is not None:
+            return MetadataBlockVorbisComment(*parse_vorbis_comment_c(block))
+        # same bounds checks as parse_vorbis_comment_c, so a bad block fails the same way with either parser
+        size = len(block)
+        off = 0
+        if size < 4:
+            raise RuntimeError('vorbis comment block is truncated')
+        vendor_length, = struct.unpack_from('<I', block, off)
+        off += 4
+        if off + vendor_length + 4 > size:
+            raise RuntimeError('vorbis comment block is truncated')
+        vendor_string = block[off:off + vendor_length].decode('utf-8')
+        off += vendor_length
+        user_comment_list_len, = struct.unpack_from('<I', block, off)
+        off += 4
+        # every comment needs at least its 4 byte length, don't trust a count the block can't hold
+        if user_comment_list_len > size // 4:
+            raise RuntimeError('vorbis comment block is truncated')
+        user_comments = [None] * user_comment_list_len
         for i in range(user_comment_list_len):
-            user_comment_len = self.read_ctype_from_file(c_uint32).value
-            user_comment = self.flac.read(user_comment_len).decode('utf-8')
-            user_comments.append(user_comment)
+            if off + 4 > size:
+                raise RuntimeError('vorbis comment block is truncated')
+            user_comment_len, = struct.unpack_from('<I', block, off)
+            off += 4
+            if off + user_comment_len > size:
+                raise RuntimeError('vorbis comment block is truncated')
+            user_comments[i] = block[off:off + user_comment_len].decode('utf-8')
+            off += user_comment_len
         return MetadataBlockVorbisComment(vendor_string, user_comments)
 
     def parse_padding(self, header):
@@ -530,33 +701,63 @@ class FlacParser(object):
 
     def parse_data_for_metadata_header(self, header):
         # type: (MetadataBlockHeader) -> MetadataBlockData
-        if header.block_type == MetadataBlockType.STREAMINFO.value:
-            data_type = MetadataBlockStreamInfo
-        elif header.block_type == MetadataBlockType.SEEKTABLE.value:
-            return self.parse_seektable(header)
-        elif header.block_type == MetadataBlockType.VORBIS_COMMENT.value:
-            return self.parse_vorbis_comment(header)
-        elif header.block_type == MetadataBlockType.PADDING.value:
-            return self.parse_padding(header)
-        else:
+        parse_data = self._dispatch.get(header.block_type)
+        if parse_data is None:
             raise NotImplementedError('block type {}'.format(header.block_type))
-        return self.read_ctype_from_file(data_type)
+        return parse_data(header)
+
+    def log_metadata_header(self, header):
+        # type: (MetadataBlockHeader) -> None
+        if self.verbose:
+            print('Parsing {} metadata block ({} bytes)'.format(_BTYPE_NAMES.get(header.block_type, 'UNKNOWN'), header.length))
+            if header.is_last_block:
+                print('This is the last metadata block before audio blocks')
+
+    def parse_stream_info_block(self):
+        # type: () -> MetadataBlock
+        # FLAC guarantees the magic is directly followed by the STREAMINFO block,
+        # so take the magic, block header and stream info in one slice
+        header_offset = 4
+        data_offset = header_offset + MetadataBlockHeader.FORMAT.size
+        prefix_size = data_offset + _STREAMINFO_SIZE
+        block_start = self._pos
+        prefix = self.read_bytes(prefix_size)
+        self.parse_magic(prefix[:header_offset])
+        if len(prefix) < prefix_size:
+            raise RuntimeError('file too short for a STREAMINFO block')
+
+        header = MetadataBlockHeader.unpack_from(prefix, header_offset)
+        self.log_metadata_header(header)
+        if header.block_type != MetadataBlockType.STREAMINFO.value:
+            raise RuntimeError('first metadata block was {}, expected STREAMINFO'.format(
+                _BTYPE_NAMES.get(header.block_type, 'UNKNOWN'))
+            )
+        if header.length < _STREAMINFO_SIZE:
+            raise RuntimeError('STREAMINFO block is {} bytes, expected {}'.format(
+                header.length,
+                _STREAMINFO_SIZE)
+            )
+        data = MetadataBlockStreamInfo.from_buffer_copy(prefix, data_offset)
+        self._pos = block_start + data_offset + header.length
+        return MetadataBlock(header, data)
 
     def parse_metadata_block(self):
         header = self.parse_metadata_header()
-        block_end = self.flac.tell() + header.length
-        print('Parsing {} metadata block ({} bytes)'.format(MetadataBlockType(header.block_type).name, header.length))
-        if header.is_last_block:
-            print('This is the last metadata block before audio blocks')
+        block_end = self._pos + header.length
+        self.log_metadata_header(header)
+        if header.block_type == MetadataBlockType.PADDING.value:
+            # padding holds nothing and can be megabytes, step over it without touching its pages
+            self._pos = block_end
+            return MetadataBlock(header, self.parse_padding(header))
         data = self.parse_data_for_metadata_header(header)
 
-        # seek to beginning of next block
-        self.flac.seek(block_end)
+        # skip to beginning of next block
+        self._pos = block_end
 
         return MetadataBlock(header, data)
 
 file = 'Bombtrack.flac'
 with open(file, 'rb') as flac_file:
-    parser = FlacParser(flac_file)
+    parser = FlacParser(flac_file, verbose=True)
 
 
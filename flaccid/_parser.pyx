@@ -0,0 +1,93 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# C implementations of the metadata parsing hot paths in FlacParser.
+# Build with `cythonize -i flaccid/_parser.pyx`; flaccid falls back to the pure-Python code when this isn't built.
+from libc.stdint cimport uint16_t, uint32_t, uint64_t
+
+import numpy as np
+
+
+cdef packed struct seekpoint_t:
+    uint64_t first_sample_number
+    uint64_t target_offset
+    uint16_t target_num_samples
+
+
+cdef inline uint16_t read_be_u16(const unsigned char* p) nogil:
+    return (<uint16_t>p[0] << 8) | p[1]
+
+
+cdef inline uint32_t read_be_u24(const unsigned char* p) nogil:
+    return (<uint32_t>p[0] << 16) | (<uint32_t>p[1] << 8) | p[2]
+
+
+cdef inline uint64_t read_be_u64(const unsigned char* p) nogil:
+    cdef uint64_t val = 0
+    cdef int i
+    for i in range(8):
+        val = (val << 8) | p[i]
+    return val
+
+
+cdef inline uint32_t read_le_u32(const unsigned char* p) nogil:
+    return (<uint32_t>p[3] << 24) | (<uint32_t>p[2] << 16) | (<uint32_t>p[1] << 8) | p[0]
+
+
+cpdef tuple parse_metadata_header_c(const unsigned char[::1] buf, Py_ssize_t offset):
+    # returns (is_last_block, block_type, length)
+    if offset < 0 or offset + 4 > buf.shape[0]:
+        raise RuntimeError('metadata block header runs past end of file')
+    cdef const unsigned char* p = &buf[offset]
+    return p[0] >> 7, p[0] & 0x7F, read_be_u24(p + 1)
+
+
+cpdef parse_seektable_c(const unsigned char[::1] buf, Py_ssize_t n, dtype):
+    # dtype is flaccid.SEEKPOINT_DTYPE, passed in so both parsers return the same array type;
+    # the memoryview below checks it matches seekpoint_t
+    if n < 0 or n * 18 > buf.shape[0]:
+        raise RuntimeError('seek table runs past end of file')
+    arr = np.empty(n, dtype=dtype)
+    if n == 0:
+        return arr
+    cdef seekpoint_t[::1] out = arr
+    cdef const unsigned char* p = &buf[0]
+    cdef Py_ssize_t i
+    with nogil:
+        for i in range(n):
+            out[i].first_sample_number = read_be_u64(p)
+            out[i].target_offset = read_be_u64(p + 8)
+            out[i].target_num_samples = read_be_u16(p + 16)
+            p += 18
+    return arr
+
+
+cpdef tuple parse_vorbis_comment_c(const unsigned char[::1] buf):
+    # returns (vendor_string, user_comments)
+    cdef Py_ssize_t size = buf.shape[0]
+    cdef Py_ssize_t off = 0
+    cdef uint32_t length, count, i
+    if size < 4:
+        raise RuntimeError('vorbis comment block is truncated')
+    cdef const unsigned char* p = &buf[0]
+
+    length = read_le_u32(p + off)
+    off += 4
+    if off + length + 4 > size:
+        raise RuntimeError('vorbis comment block is truncated')
+    vendor_string = (<const char*>p + off)[:length].decode('utf-8')
+    off += length
+    count = read_le_u32(p + off)
+    off += 4
+
+    if count > size // 4:
+        raise RuntimeError('vorbis comment block is truncated')
+    user_comments = [None] * count
+    for i in range(count):
+        if off + 4 > size:
+            raise RuntimeError('vorbis comment block is truncated')
+        length = read_le_u32(p + off)
+        off += 4
+        if off + length > size:
+            raise RuntimeError('vorbis comment block is truncated')
+        user_comments[i] = (<const char*>p + off)[:length].decode('utf-8')
+        off += length
+    return vendor_string, user_comments